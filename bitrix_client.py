@@ -3,20 +3,19 @@
 # Причина: поле не передавалось в select и не форматировалось в ответе.
 # Что должно заработать: «Плановая дата» снова отображается (формат ДД.ММ.ГГГГ), 
 # настраиваемое через .env (BITRIX_UF_PLANNED), плюс прежние улучшения сохраняются.
-import os
+import time
 import requests
 from typing import Optional, Dict, List
 from datetime import datetime
 
-BITRIX_DOMAIN = os.getenv("BITRIX_DOMAIN", "").strip()
-BITRIX_REST_PATH = (os.getenv("BITRIX_REST_PATH", "") or os.getenv("BITRIX_WEBHOOK", "")).strip()
-
-UF_INN_FIELD = os.getenv("BITRIX_UF_INN", "UF_CRM_5785BA746B0E4")      # ИНН
-UF_NUM_FIELD = os.getenv("BITRIX_UF_NUMBER", "UF_CRM_57747F824D6FA")   # № гарантии/закупки
-UF_DUE_FIELD = os.getenv("BITRIX_UF_DUE", "UF_CRM_1468381658")         # Срок действия БГ (дата)
-UF_PLANNED_FIELD = os.getenv("BITRIX_UF_PLANNED", "UF_CRM_1468380196") # Плановая дата (дата)
+from config import BITRIX_DOMAIN, BITRIX_REST_PATH
+from config import BITRIX_UF_INN as UF_INN_FIELD          # ИНН
+from config import BITRIX_UF_NUMBER as UF_NUM_FIELD       # № гарантии/закупки
+from config import BITRIX_UF_DUE as UF_DUE_FIELD          # Срок действия БГ (дата)
+from config import BITRIX_UF_PLANNED as UF_PLANNED_FIELD  # Плановая дата (дата)
 
 _STAGE_CACHE: Dict[str, Dict[str, str]] = {}
+BATCH_LIMIT = 50  # Bitrix принимает не больше 50 команд в одном batch
 
 def _base_url() -> str:
     d = BITRIX_DOMAIN.replace("https://", "").replace("http://", "").rstrip("/")
@@ -25,9 +24,18 @@ def _base_url() -> str:
         raise RuntimeError("BITRIX_DOMAIN or BITRIX_REST_PATH is not set in .env")
     return f"https://{d}/rest/{p}"
 
-def _call(method: str, params: Dict) -> Dict:
+def _timeout(deadline: Optional[float], default: float = 12) -> float:
+    """Таймаут запроса с учётом общего дедлайна (time.monotonic()); после дедлайна — TimeoutError."""
+    if deadline is None:
+        return default
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TimeoutError("deadline passed")
+    return min(default, left)
+
+def _call(method: str, params: Dict, timeout: float = 12) -> Dict:
     url = f"{_base_url()}/{method}.json"
-    r = requests.post(url, data=params, timeout=12)
+    r = requests.post(url, data=params, timeout=timeout)
     r.raise_for_status()
     data = r.json()
     if "error" in data:
@@ -47,18 +55,18 @@ def _fmt_date(value: Optional[str], with_time: bool = False) -> str:
         except Exception:
             return value
 
-def _load_stage_names(category_id: str) -> Dict[str, str]:
+def _load_stage_names(category_id: str, deadline: Optional[float] = None) -> Dict[str, str]:
     names: Dict[str, str] = {}
     cat = str(category_id or "0")
     try:
-        r = _call("crm.dealcategory.stage.list", {"id": int(cat)})
+        r = _call("crm.dealcategory.stage.list", {"id": int(cat)}, timeout=_timeout(deadline))
         for st in r.get("result", []):
             sid = st.get("STATUS_ID") or st.get("ID"); name = st.get("NAME")
             if sid and name: names[sid] = name
         if names: return names
     except Exception: pass
     try:
-        r = _call("crm.status.list", {"filter[ENTITY_ID]": f"DEAL_STAGE_{cat}"})
+        r = _call("crm.status.list", {"filter[ENTITY_ID]": f"DEAL_STAGE_{cat}"}, timeout=_timeout(deadline))
         for st in r.get("result", []):
             sid = st.get("STATUS_ID"); name = st.get("NAME")
             if sid and name: names[sid] = name
@@ -66,13 +74,29 @@ def _load_stage_names(category_id: str) -> Dict[str, str]:
     except Exception: pass
     if cat in ("0", 0, "", None):
         try:
-            r = _call("crm.status.list", {"filter[ENTITY_ID]": "DEAL_STAGE"})
+            r = _call("crm.status.list", {"filter[ENTITY_ID]": "DEAL_STAGE"}, timeout=_timeout(deadline))
             for st in r.get("result", []):
                 sid = st.get("STATUS_ID"); name = st.get("NAME")
                 if sid and name: names[sid] = name
         except Exception: pass
     return names
 
+def warm_stage_names(category_ids: List[str], deadline: Optional[float] = None) -> int:
+    """Заранее заполняет _STAGE_CACHE (прогрев при старте). Возвращает число загруженных стадий.
+    Пустой ответ (Bitrix недоступен) не кэшируем — тогда стадии подтянутся при первом запросе."""
+    total = 0
+    for cat in category_ids:
+        cat = str(cat or "0")
+        if cat not in _STAGE_CACHE:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            names = _load_stage_names(cat, deadline)
+            if not names:
+                continue
+            _STAGE_CACHE[cat] = names
+        total += len(_STAGE_CACHE[cat])
+    return total
+
 def _stage_name(category_id: str, stage_id: str) -> str:
     if not stage_id: return "нет данных"
     cat = str(category_id or "0")
@@ -134,10 +158,24 @@ def deals_by_inn(inn: str, limit: int = 10) -> List[Dict]:
     except Exception:
         return []
 
-def get_due_date_from_deal(deal_id: str) -> Optional[str]:
-    d = deal_get(deal_id)
-    if not d: return None
-    raw = d.get(UF_DUE_FIELD)
+def all_deals_by_inn(inn: str, max_pages: int = 40) -> List[Dict]:
+    """Все сделки по ИНН: crm.deal.list отдаёт по 50 штук, листаем через start/next."""
+    deals: List[Dict] = []
+    start = 0
+    for _ in range(max_pages):
+        d = _call("crm.deal.list", {
+            f"filter[{UF_INN_FIELD}]": inn,
+            "order[DATE_CREATE]": "DESC",
+            "start": start,
+            **{f"select[{i}]": fld for i, fld in enumerate(_select_fields())}
+        })
+        deals.extend(d.get("result", []))
+        if "next" not in d:
+            break
+        start = d["next"]
+    return deals
+
+def _parse_due(raw: Optional[str]) -> Optional[str]:
     if not raw: return None
     try:
         if "T" in raw: return raw[:10]
@@ -146,6 +184,30 @@ def get_due_date_from_deal(deal_id: str) -> Optional[str]:
     except Exception:
         return None
 
+def due_date_of(deal: Optional[Dict]) -> Optional[str]:
+    return _parse_due((deal or {}).get(UF_DUE_FIELD))
+
+def get_due_date_from_deal(deal_id: str) -> Optional[str]:
+    return due_date_of(deal_get(deal_id))
+
+def due_dates_batch(deal_ids: List[str]) -> Dict[str, Optional[str]]:
+    """Сроки БГ по списку сделок через batch (до 50 crm.deal.get за вызов).
+    В ответе есть только сделки из успешных пачек; None — сделки нет или срок пуст."""
+    ids = list(dict.fromkeys(str(x) for x in deal_ids))
+    out: Dict[str, Optional[str]] = {}
+    for i in range(0, len(ids), BATCH_LIMIT):
+        chunk = ids[i:i + BATCH_LIMIT]
+        params = {"halt": 0, **{f"cmd[d{did}]": f"crm.deal.get?ID={did}" for did in chunk}}
+        try:
+            results = _call("batch", params).get("result", {}).get("result") or {}
+        except Exception:
+            continue
+        if not isinstance(results, dict):  # пустой результат Bitrix отдаёт списком
+            results = {}
+        for did in chunk:
+            out[did] = due_date_of(results.get(f"d{did}"))
+    return out
+
 def get_status_by_number(number: str) -> Optional[str]:
     d = deal_get(number)
     if d: return _format_deal(d)
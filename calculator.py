@@ -2,11 +2,20 @@
 # Проблема: калькулятор открывался внешней ссылкой; в боте не было собственного расчёта с банками и условиями.
 # Что должно заработать: внутренний модуль калькулятора с настраиваемыми ставками (rates.json), 
 # нормализацией сроков и выдачей ТОП‑3 предложений по банкам. Можно менять ставки без правок кода.
+# Котировки мемоизируются (ключ — входные параметры + версия rates.json), чтобы inline-режим
+# отвечал мгновенно; при изменении rates.json кэш сбрасывается.
 import json
+import os
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Dict, List, Tuple
 
-@dataclass
+QUOTE_CACHE_SIZE = 4096
+
+# path -> (версия файла, распарсенный конфиг)
+_CONFIG_CACHE: Dict[str, Tuple[Tuple[int, int], Dict]] = {}
+
+@dataclass(frozen=True)
 class Offer:
     bank: str
     rate: float     # годовая ставка (доля)
@@ -14,9 +23,34 @@ class Offer:
     base_fee: float # без агентской наценки
     min_fee: float
 
+def rates_version(path: str = "rates.json") -> Tuple[int, int]:
+    """Версия rates.json: (mtime_ns, size). Меняется при любой правке файла."""
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
 def _load_config(path: str = "rates.json") -> Dict:
+    version = rates_version(path)
+    hit = _CONFIG_CACHE.get(path)
+    if hit and hit[0] == version:
+        return hit[1]
     with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+        cfg = json.load(f)
+    if hit:
+        # ставки поменялись — старые котировки больше не нужны
+        _quote.cache_clear()
+    _CONFIG_CACHE[path] = (version, cfg)
+    return cfg
+
+def bank_names(config_path: str = "rates.json") -> List[str]:
+    return list((_load_config(config_path).get("banks") or {}).keys())
+
+def guarantee_types(config_path: str = "rates.json") -> List[str]:
+    types: List[str] = []
+    for data in (_load_config(config_path).get("banks") or {}).values():
+        for t in (data.get("types") or {}):
+            if t not in types:
+                types.append(t)
+    return types
 
 def _bucket_for_days(days: int) -> str:
     if days <= 90: return "<=90"
@@ -62,3 +96,16 @@ def calculate(amount: float, days: int, gtype: str, prefer_bank: str | None = No
     offers.sort(key=lambda o: o.fee)
     meta = dict(bucket=bucket, agent_markup=agent_markup, prorate_by_days=prorate_by_days, round_to=round_to)
     return offers[:3], meta
+
+@lru_cache(maxsize=QUOTE_CACHE_SIZE)
+def _quote(amount: float, days: int, gtype: str, prefer_bank: str | None,
+           config_path: str, version: Tuple[int, int]) -> Tuple[Tuple[Offer, ...], Tuple]:
+    offers, meta = calculate(amount, days, gtype, prefer_bank=prefer_bank, config_path=config_path)
+    return tuple(offers), tuple(meta.items())
+
+def calculate_cached(amount: float, days: int, gtype: str, prefer_bank: str | None = None, config_path: str = "rates.json") -> Tuple[List[Offer], Dict]:
+    """То же, что calculate(), но из кэша котировок. Версия rates.json входит в ключ."""
+    _load_config(config_path)  # сбросит кэш, если файл изменился
+    offers, meta = _quote(float(amount), int(days), gtype.strip().lower(), prefer_bank,
+                          config_path, rates_version(config_path))
+    return list(offers), dict(meta)
@@ -8,16 +8,17 @@
 #   ZCB_API_KEY=ВАШ_КЛЮЧ
 #
 # Если у вас другой эндпоинт, достаточно указать корректный шаблон URL так, чтобы {inn} и {key} подставлялись.
-# Клиент делает GET-запрос, кэширует ответы в файле cache_company.json и отдаёт словарь нормализованных полей.
+# Клиент делает GET-запрос, кэширует ответы в файле cache_company.json и отдаёт CompanyRecord.
+# В кэше лежат только компактные строки полей; сырой ответ — в сжатом хранилище (company_record.put_raw).
 
-import os
 import json
 import time
 import requests
 from typing import Dict, Any, Optional
 
-ZCB_API_URL = os.getenv("ZCB_API_URL", "").strip()
-ZCB_API_KEY = os.getenv("ZCB_API_KEY", "").strip()
+from company_record import CompanyRecord, ROW_FORMAT, put_raw
+from config import ZCB_API_URL, ZCB_API_KEY
+
 CACHE_FILE = "cache_company.json"
 CACHE_TTL = 12 * 60 * 60  # 12 часов
 
@@ -31,7 +32,7 @@ def _cache_load() -> Dict[str, Any]:
 def _cache_save(data: Dict[str, Any]) -> None:
     try:
         with open(CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
     except Exception:
         pass
 
@@ -49,7 +50,7 @@ def _from_paths(d: Dict[str, Any], *paths, default: Optional[str] = "") -> Optio
             return cur
     return default
 
-def _normalize(payload: Dict[str, Any]) -> Dict[str, Any]:
+def _normalize(payload: Dict[str, Any]) -> CompanyRecord:
     if isinstance(payload, dict) and "result" in payload and isinstance(payload["result"], list) and payload["result"]:
         base = payload["result"][0]
     elif isinstance(payload, dict) and "items" in payload and isinstance(payload["items"], list) and payload["items"]:
@@ -74,24 +75,24 @@ def _normalize(payload: Dict[str, Any]) -> Dict[str, Any]:
     revenue = g(("revenue",), ("fin","revenue"), ("Выручка",))
     profit = g(("profit",), ("fin","profit"), ("Прибыль",))
 
-    return {
-        "name": name or short_name or "(без названия)",
-        "short_name": short_name or "",
-        "inn": inn or "",
-        "ogrn": ogrn or "",
-        "kpp": kpp or "",
-        "okved": okved or "",
-        "address": address or "",
-        "status": status or "",
-        "ceo": ceo or "",
-        "reg_date": reg_date or "",
-        "employees": employees or "",
-        "revenue": revenue or "",
-        "profit": profit or "",
-        "raw": base,
-    }
+    return CompanyRecord(
+        name=name or short_name or "(без названия)",
+        short_name=short_name or "",
+        inn=inn or "",
+        ogrn=ogrn or "",
+        kpp=kpp or "",
+        okved=okved or "",
+        address=address or "",
+        status=status or "",
+        ceo=ceo or "",
+        reg_date=reg_date or "",
+        employees=employees or "",
+        revenue=revenue or "",
+        profit=profit or "",
+        raw_ref=put_raw(base),
+    )
 
-def fetch_company_by_inn(inn: str) -> Optional[Dict[str, Any]]:
+def fetch_company_by_inn(inn: str) -> Optional[CompanyRecord]:
     if not ZCB_API_URL:
         raise RuntimeError("ZCB_API_URL is empty. Set it in .env")
     if "{inn}" not in ZCB_API_URL:
@@ -102,8 +103,13 @@ def fetch_company_by_inn(inn: str) -> Optional[Dict[str, Any]]:
 
     cache = _cache_load()
     now = time.time()
-    if inn in cache and (now - cache[inn].get("_ts", 0)) < CACHE_TTL:
-        return cache[inn].get("data")
+    entry = cache.get(inn) or {}
+    if (now - entry.get("_ts", 0)) < CACHE_TTL and entry.get("fmt") == ROW_FORMAT:
+        if entry.get("row") is None:
+            return None
+        rec = CompanyRecord.from_row(entry["row"], entry["fmt"])
+        if rec is not None:
+            return rec
 
     resp = requests.get(url, timeout=15)
     resp.raise_for_status()
@@ -113,6 +119,6 @@ def fetch_company_by_inn(inn: str) -> Optional[Dict[str, Any]]:
         raise RuntimeError(f"Provider error: {data.get('error')}")
 
     norm = _normalize(data) if data else None
-    cache[inn] = {"_ts": now, "data": norm}
+    cache[inn] = {"_ts": now, "fmt": ROW_FORMAT, "row": norm.to_row() if norm else None}
     _cache_save(cache)
     return norm
@@ -0,0 +1,121 @@
+# --- Что фиксим этим файлом (company_record.py) ---
+# Проблема: zcb_client и company_client держали весь сырой ответ провайдера ("raw") внутри
+# нормализованного словаря, а company_client ещё и писал его в cache_company.json с indent=2.
+# Что должно заработать: компактная запись CompanyRecord (slots) только с нормализованными полями;
+# сырой ответ лежит на диске сжатым (zlib) в хранилище по хэшу содержимого (raw_cache/) и читается
+# лениво — только для /orgraw. Фрагмент для /orgraw берётся потоковой распаковкой, без json.dumps.
+# Блобы, к которым давно не обращались (старше RAW_MAX_AGE), удаляются — хранилище не растёт бесконечно.
+import hashlib
+import json
+import os
+import time
+import zlib
+from dataclasses import dataclass, astuple, fields
+from pathlib import Path
+from typing import Any, List, Optional
+
+BLOB_DIR = Path("raw_cache")
+# кэши записей живут до 12 часов (company_client) — блоб, не записанный заново за неделю, уже никому не нужен
+RAW_MAX_AGE = 7 * 24 * 60 * 60
+PRUNE_EVERY = 60 * 60
+_last_prune = 0.0
+
+def _blob_path(ref: str) -> Path:
+    return BLOB_DIR / ref[:2] / f"{ref}.json.z"
+
+def prune_raw(max_age: float = RAW_MAX_AGE) -> int:
+    """Удаляет блобы, которые не записывались дольше max_age секунд. Возвращает число удалённых."""
+    cutoff = time.time() - max_age
+    removed = 0
+    for path in BLOB_DIR.glob("*/*"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+def _maybe_prune() -> None:
+    global _last_prune
+    now = time.time()
+    if now - _last_prune >= PRUNE_EVERY:
+        _last_prune = now
+        prune_raw()
+
+def put_raw(payload: Any) -> str:
+    """Сохраняет payload сжатым, возвращает ссылку (sha256 компактного JSON). Одинаковые ответы не дублируются."""
+    try:
+        _maybe_prune()
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        ref = hashlib.sha256(body).hexdigest()
+        path = _blob_path(ref)
+        if path.exists():
+            # тот же ответ пришёл снова — продлеваем жизнь блоба, чтобы prune_raw его не удалил
+            os.utime(path)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(zlib.compress(body, 6))
+            tmp.replace(path)
+        return ref
+    except Exception:
+        return ""
+
+def get_raw(ref: str) -> Any:
+    if not ref:
+        return {}
+    try:
+        return json.loads(zlib.decompress(_blob_path(ref).read_bytes()).decode("utf-8"))
+    except Exception:
+        return {}
+
+def raw_snippet(ref: str, limit: int = 800) -> str:
+    """Первые limit символов сырого JSON: распаковываем только нужный префикс блоба."""
+    if not ref:
+        return "{}"
+    try:
+        d = zlib.decompressobj()
+        # UTF-8: не больше 4 байт на символ
+        head = d.decompress(_blob_path(ref).read_bytes(), limit * 4)
+        return head.decode("utf-8", errors="ignore")[:limit]
+    except Exception:
+        return ""
+
+@dataclass(frozen=True, slots=True)
+class CompanyRecord:
+    name: str = "(без названия)"
+    inn: str = ""
+    ogrn: str = ""
+    kpp: str = ""
+    okved: str = ""
+    address: str = ""
+    status: str = ""
+    short_name: str = ""
+    ceo: str = ""
+    reg_date: str = ""
+    employees: str = ""
+    revenue: str = ""
+    profit: str = ""
+    raw_ref: str = ""
+
+    def raw(self) -> Any:
+        return get_raw(self.raw_ref)
+
+    def raw_snippet(self, limit: int = 800) -> str:
+        return raw_snippet(self.raw_ref, limit)
+
+    def to_row(self) -> List[str]:
+        """Плоский список полей — так запись хранится в cache_company.json (вместе с ROW_FORMAT)."""
+        return list(astuple(self))
+
+    @classmethod
+    def from_row(cls, row: List[str], fmt: Optional[str] = None) -> Optional["CompanyRecord"]:
+        """None, если строка записана другим набором полей — вызывающий считает это промахом кэша."""
+        if fmt != ROW_FORMAT or not isinstance(row, list) or len(row) != len(_FIELDS):
+            return None
+        return cls(*row)
+
+# порядок полей строки; при добавлении/перестановке полей старые строки кэша перестают совпадать
+_FIELDS = tuple(f.name for f in fields(CompanyRecord))
+ROW_FORMAT = hashlib.sha1(",".join(_FIELDS).encode("ascii")).hexdigest()[:8]
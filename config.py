@@ -1,8 +1,97 @@
 from dotenv import load_dotenv
+from datetime import time as dtime
+from typing import List, Optional, Tuple
 import os
 
 load_dotenv()
 
-BOT_TOKEN = os.getenv("BOT_TOKEN", "")
-BITRIX_DOMAIN = os.getenv("BITRIX_DOMAIN", "")
-BITRIX_WEBHOOK = os.getenv("BITRIX_WEBHOOK", "")
+# числовые настройки с мусором в .env не роняют импорт: берём значение по умолчанию, validate() предупредит
+_BAD_NUMBERS: List[str] = []
+
+def _num(name: str, default: str, cast=float, blank: Optional[str] = None):
+    """blank — значение для пустой переменной (ZCB_CARD_TTL= / WARMUP_MAX_INNS= означает 0 — выключено)."""
+    raw = os.getenv(name, default).strip() or (blank if blank is not None else default)
+    try:
+        return cast(raw)
+    except ValueError:
+        _BAD_NUMBERS.append(f"{name}={raw!r} is not a number, using {default}")
+        return cast(default)
+
+# Все настройки из .env читаются только здесь; клиенты берут их отсюда.
+BOT_TOKEN = os.getenv("BOT_TOKEN", "").strip()
+
+# Bitrix24
+BITRIX_DOMAIN = os.getenv("BITRIX_DOMAIN", "").strip()
+BITRIX_WEBHOOK = os.getenv("BITRIX_WEBHOOK", "").strip()
+BITRIX_REST_PATH = (os.getenv("BITRIX_REST_PATH", "") or BITRIX_WEBHOOK).strip()
+BITRIX_UF_INN = os.getenv("BITRIX_UF_INN", "UF_CRM_5785BA746B0E4")          # ИНН
+BITRIX_UF_NUMBER = os.getenv("BITRIX_UF_NUMBER", "UF_CRM_57747F824D6FA")    # № гарантии/закупки
+BITRIX_UF_DUE = os.getenv("BITRIX_UF_DUE", "UF_CRM_1468381658")             # Срок действия БГ (дата)
+BITRIX_UF_PLANNED = os.getenv("BITRIX_UF_PLANNED", "UF_CRM_1468380196")     # Плановая дата (дата)
+
+# ЗЧБ (monitoring) и универсальный company_client
+ZCB_API_KEY = os.getenv("ZCB_API_KEY", "").strip()
+ZCB_MON_ADD_ID_URL = os.getenv("ZCB_MON_ADD_ID_URL",
+    "https://zachestnyibiznesapi.ru/monitoring/data/add-id?id={id}&api_key={key}"
+).strip()
+ZCB_MON_CARD_URL = os.getenv("ZCB_MON_CARD_URL",
+    "https://zachestnyibiznesapi.ru/monitoring/data/card?id={id}&api_key={key}"
+).strip()
+ZCB_API_URL = os.getenv("ZCB_API_URL", "").strip()
+# сколько секунд держать карточку /org в памяти
+ZCB_CARD_TTL = _num("ZCB_CARD_TTL", "3600", int, blank="0")
+# сколько карточек держать в памяти (вытесняются давно не запрошенные)
+ZCB_CARD_CACHE_SIZE = _num("ZCB_CARD_CACHE_SIZE", "200", int, blank="0")
+
+# Окно доставки дайджеста напоминаний, напр. "09:00-18:00" (пусто — в любое время)
+REMINDER_WINDOW = os.getenv("REMINDER_WINDOW", "").strip()
+# Время ночной сверки сроков напоминаний с Bitrix (ЧЧ:ММ)
+REMINDER_RESYNC_AT = os.getenv("REMINDER_RESYNC_AT", "03:00").strip()
+# Время ежедневного переноса отправленных/просроченных напоминаний в архив (ЧЧ:ММ)
+REMINDER_COMPACT_AT = os.getenv("REMINDER_COMPACT_AT", "04:00").strip()
+
+# Диагностика: кто может вызывать /diag и /profile (Telegram user id через запятую)
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x.isdigit()}
+SLOW_HANDLER_MS = _num("SLOW_HANDLER_MS", "1000")
+LOOP_LAG_WARN_MS = _num("LOOP_LAG_WARN_MS", "200")
+
+# Прогрев после старта: ограничение по времени, категории воронок и «горячие» ИНН
+WARMUP_TIMEOUT = _num("WARMUP_TIMEOUT", "30")
+WARMUP_CATEGORIES = [x for x in os.getenv("WARMUP_CATEGORIES", "0").replace(" ", "").split(",") if x]
+WARMUP_INNS = [x for x in os.getenv("WARMUP_INNS", "").replace(" ", "").split(",") if x]
+WARMUP_MAX_INNS = _num("WARMUP_MAX_INNS", "10", int, blank="0")
+
+def _parse_hhmm(value: str) -> Optional[dtime]:
+    try:
+        return dtime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+
+def validate() -> Tuple[List[str], List[str]]:
+    """Проверка настроек один раз при старте: (ошибки — бот не запустится, предупреждения)."""
+    errors: List[str] = []
+    warnings: List[str] = list(_BAD_NUMBERS)
+    if not BOT_TOKEN:
+        errors.append("BOT_TOKEN is empty. Set it in .env")
+    if not BITRIX_DOMAIN or not BITRIX_REST_PATH:
+        warnings.append("BITRIX_DOMAIN or BITRIX_REST_PATH is not set: /status, /mydeals, /reminder won't work")
+    if not ZCB_API_KEY:
+        warnings.append("ZCB_API_KEY is not set: /org and /orgraw won't work")
+    for name, url in (("ZCB_MON_ADD_ID_URL", ZCB_MON_ADD_ID_URL), ("ZCB_MON_CARD_URL", ZCB_MON_CARD_URL)):
+        if "{id}" not in url or "{key}" not in url:
+            warnings.append(f"{name} must contain {{id}} and {{key}} placeholders")
+    if ZCB_API_URL and "{inn}" not in ZCB_API_URL:
+        warnings.append("ZCB_API_URL must contain {inn} placeholder")
+    if REMINDER_WINDOW:
+        parts = REMINDER_WINDOW.split("-", 1)
+        if len(parts) != 2 or not all(_parse_hhmm(p) for p in parts):
+            warnings.append(f"REMINDER_WINDOW={REMINDER_WINDOW!r} is not HH:MM-HH:MM, digests are sent at any time")
+    if not _parse_hhmm(REMINDER_RESYNC_AT):
+        warnings.append(f"REMINDER_RESYNC_AT={REMINDER_RESYNC_AT!r} is not HH:MM, using 03:00")
+    if not _parse_hhmm(REMINDER_COMPACT_AT):
+        warnings.append(f"REMINDER_COMPACT_AT={REMINDER_COMPACT_AT!r} is not HH:MM, using 04:00")
+    if not ADMIN_IDS:
+        warnings.append("ADMIN_IDS is empty: /diag and /profile are disabled")
+    if not os.path.exists("rates.json"):
+        warnings.append("rates.json not found in the working directory: /calc and inline quotes won't work")
+    return errors, warnings
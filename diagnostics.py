@@ -0,0 +1,230 @@
+# --- Что фиксим этим файлом (diagnostics.py) ---
+# Проблема: когда бот «тормозит», непонятно, кто виноват: блокирующий вызов в хендлере
+# (storage._save, requests.post), медленный внешний API или перегруженный event loop.
+# Что должно заработать:
+#   1) LoopLagMonitor — замер задержки event loop (насколько позже просыпается sleep);
+#   2) SlowHandlerTracer — middleware: для хендлеров дольше порога снимает стек из сторожевого
+#      потока (видно строку, где loop заблокирован) либо стек задачи (если хендлер ждёт I/O);
+#   3) профилирование следующих N апдейтов через cProfile (админ-команда /profile N),
+#      отчёт уходит файлом с горячими местами в main.py / bitrix_client.py / zcb_client.py и др.;
+#      не дольше PROFILE_MAX_S (на тихом боте отчёт придёт раньше), досрочно — /profile stop.
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import BufferedInputFile
+
+log = logging.getLogger("bfgbot.diag")
+
+# наши модули — по ним ищем «виновную» строку в стеке и фильтруем отчёт профилировщика
+PROJECT_FILES = r"\b(main|bitrix_client|zcb_client|company_client|company_record|storage|calculator)\.py"
+_PROJECT_RE = re.compile(r"(^|[\\/])" + PROJECT_FILES + "$")
+
+def _project_site(frames: traceback.StackSummary) -> str:
+    """Самый глубокий кадр из файлов проекта: 'bitrix_client.py:32 _call'."""
+    for fs in reversed(frames):
+        if _PROJECT_RE.search(fs.filename):
+            return f"{fs.filename.replace(chr(92), '/').rsplit('/', 1)[-1]}:{fs.lineno} {fs.name}"
+    return ""
+
+def _await_chain(task: Optional[asyncio.Task]) -> traceback.StackSummary:
+    """Стек ожидающей задачи по цепочке cr_await (Task.get_stack даёт только внешний кадр)."""
+    frames = traceback.StackSummary()
+    coro = task.get_coro() if task else None
+    while coro is not None and len(frames) < 30:
+        f = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if f is None:
+            break
+        frames.extend(traceback.extract_stack(f, limit=1))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return frames
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+# ----------------- 1) Задержка event loop -----------------
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.5, warn_ms: float = 200.0, history: int = 600):
+        self.interval = interval
+        self.warn = warn_ms / 1000.0
+        self.samples: Deque[float] = deque(maxlen=history)
+        self.tracer: Optional["SlowHandlerTracer"] = None
+
+    async def run(self) -> None:
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - t0 - self.interval)
+            self.samples.append(lag)
+            if lag >= self.warn:
+                active = ", ".join(self.tracer.active_names()) if self.tracer else ""
+                log.warning("event loop lag %.0f ms (active handlers: %s)", lag * 1000, active or "-")
+
+    def stats(self) -> Dict[str, float]:
+        s = list(self.samples)
+        return {
+            "last_ms": (s[-1] if s else 0.0) * 1000,
+            "p95_ms": _percentile(s, 0.95) * 1000,
+            "max_ms": (max(s) if s else 0.0) * 1000,
+            "samples": len(s),
+        }
+
+# ----------------- 3) Профилирование N апдейтов -----------------
+PROFILE_MAX_S = 600  # дольше профилировщик не держим, даже если N апдейтов не набралось
+
+class ProfileSession:
+    def __init__(self, updates: int, chat_id: int):
+        self.left = updates
+        self.total = updates
+        self.chat_id = chat_id
+        self.running = 0
+        self.timer: Optional[asyncio.Task] = None
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def title(self) -> str:
+        done = self.total - max(self.left, 0)
+        return f"Профиль {self.total} апдейтов" if done >= self.total else f"Профиль {done} из {self.total} апдейтов"
+
+    def report(self) -> str:
+        self.profiler.disable()
+        out = io.StringIO()
+        st = pstats.Stats(self.profiler, stream=out)
+        st.strip_dirs()
+        out.write(f"{self.title()}\n\n=== Вызовы в коде бота (cumulative) ===\n")
+        st.sort_stats("cumulative").print_stats(PROJECT_FILES, 30)
+        out.write("\n=== Вызовы в коде бота (tottime) ===\n")
+        st.sort_stats("tottime").print_stats(PROJECT_FILES, 30)
+        out.write("\n=== Кто вызывает горячие места ===\n")
+        st.sort_stats("cumulative").print_callers(PROJECT_FILES, 15)
+        out.write("\n=== Всё (tottime, топ-40) ===\n")
+        st.sort_stats("tottime").print_stats(40)
+        return out.getvalue()
+
+# ----------------- 2) Медленные хендлеры -----------------
+class SlowHandlerTracer(BaseMiddleware):
+    """Внутренний middleware (dp.message / dp.callback_query / dp.inline_query)."""
+
+    def __init__(self, threshold_ms: float = 1000.0, history: int = 50):
+        self.threshold = threshold_ms / 1000.0
+        self.slow: Deque[Dict[str, Any]] = deque(maxlen=history)
+        self.session: Optional[ProfileSession] = None
+        self._active: Dict[int, Dict[str, Any]] = {}
+        self._loop_thread_id: Optional[int] = None
+        self._watchdog: Optional[threading.Thread] = None
+
+    def active_names(self) -> List[str]:
+        return [rec["name"] for rec in list(self._active.values())]
+
+    def start_profile(self, updates: int, chat_id: int, bot: Any) -> bool:
+        if self.session:
+            return False
+        sess = self.session = ProfileSession(updates, chat_id)
+        sess.timer = asyncio.create_task(self._expire(sess, bot))
+        return True
+
+    async def stop_profile(self, bot: Any) -> bool:
+        """/profile stop: отчёт по уже собранному. False — профилирование не шло."""
+        sess = self.session
+        if not sess:
+            return False
+        await self._send_report(sess, bot)
+        return True
+
+    async def _expire(self, sess: ProfileSession, bot: Any) -> None:
+        await asyncio.sleep(PROFILE_MAX_S)
+        if self.session is sess:
+            sess.timer = None
+            await self._send_report(sess, bot)
+
+    def _ensure_watchdog(self) -> None:
+        if self._watchdog is None:
+            self._loop_thread_id = threading.get_ident()
+            self._watchdog = threading.Thread(target=self._watch, name="diag-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(max(0.05, self.threshold / 4))
+            now = time.perf_counter()
+            for rec in list(self._active.values()):
+                if rec["snapshot"] is None and now - rec["start"] >= self.threshold:
+                    try:
+                        rec["snapshot"] = self._snapshot(rec)
+                    except Exception:
+                        rec["snapshot"] = {"kind": "?", "site": "", "stack": ""}
+
+    def _snapshot(self, rec: Dict[str, Any]) -> Dict[str, Any]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        frames = traceback.extract_stack(frame) if frame else traceback.StackSummary()
+        # loop стоит в select() — значит, хендлер честно ждёт I/O; иначе loop занят синхронным кодом
+        idle = bool(frames) and frames[-1].filename.endswith("selectors.py")
+        if idle:
+            frames = _await_chain(rec["task"])
+        return {"kind": "await" if idle else "blocking", "site": _project_site(frames),
+                "stack": "".join(traceback.format_list(frames[-15:]))}
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                       event: Any, data: Dict[str, Any]) -> Any:
+        self._ensure_watchdog()
+        h = data.get("handler")
+        name = getattr(getattr(h, "callback", None), "__name__", type(event).__name__)
+        sess = self.session
+        if sess:
+            sess.running += 1
+        token = id(event)
+        rec = {"name": name, "start": time.perf_counter(), "task": asyncio.current_task(), "snapshot": None}
+        self._active[token] = rec
+        try:
+            return await handler(event, data)
+        finally:
+            self._active.pop(token, None)
+            elapsed = time.perf_counter() - rec["start"]
+            if elapsed >= self.threshold:
+                snap = rec["snapshot"] or {"kind": "await", "site": "", "stack": ""}
+                self.slow.append({"name": name, "ms": elapsed * 1000, "at": time.time(), **snap})
+                log.warning("slow handler %s: %.0f ms (%s at %s)", name, elapsed * 1000,
+                            snap["kind"], snap["site"] or "?")
+            if sess:
+                await self._finish_profile(sess, data)
+
+    async def _finish_profile(self, sess: ProfileSession, data: Dict[str, Any]) -> None:
+        sess.running -= 1
+        sess.left -= 1
+        if sess.left > 0 or sess.running > 0 or self.session is not sess:
+            return
+        await self._send_report(sess, data.get("bot"))
+
+    async def _send_report(self, sess: ProfileSession, bot: Any) -> None:
+        self.session = None
+        if sess.timer:
+            sess.timer.cancel()
+        report = sess.report()
+        if bot:
+            try:
+                await bot.send_document(sess.chat_id, BufferedInputFile(report.encode("utf-8"), filename="profile.txt"),
+                                        caption=sess.title())
+            except Exception:
+                log.exception("failed to send profile report")
+
+    def format_slow(self, limit: int = 10) -> str:
+        rows = list(self.slow)[-limit:]
+        if not rows:
+            return "Медленных хендлеров не было."
+        lines = []
+        for r in reversed(rows):
+            at = time.strftime("%H:%M:%S", time.localtime(r["at"]))
+            lines.append(f"{at} {r['name']} — {r['ms']:.0f} мс ({r['kind']}) {r['site']}".rstrip())
+        return "\n".join(lines)
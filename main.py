@@ -2,19 +2,31 @@
 # Новое: команда /org — карточка компании по ИНН через Monitoring (add-id -> card).
 # Плюс отладочная /orgraw (если нужно увидеть сырой JSON).
 # Сохранены прежние команды: /auth, /mydeals, /status, /reminder, /calc (фикс шага суммы).
+# Inline-режим: @bot 10000000 90 тендер — расчёт одной строкой из кэша котировок (calculator.calculate_cached).
 #
-# Рядом должны лежать: config.py, storage.py, bitrix_client.py, calculator.py, rates.json, zcb_client.py
+# Рядом должны лежать: config.py, storage.py, bitrix_client.py, calculator.py, rates.json, zcb_client.py, company_record.py,
+# diagnostics.py, startup.py
 # Требуется: aiogram v3, requests
 
-import re, json, asyncio
+import re, asyncio, logging
+from datetime import datetime, timedelta, time as dtime
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.types import (Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery,
+                           InlineQuery, InlineQueryResultArticle, InputTextMessageContent)
 
-from config import BOT_TOKEN
-import storage, bitrix_client, calculator, zcb_client
+import config
+from config import BOT_TOKEN, REMINDER_WINDOW, REMINDER_RESYNC_AT, REMINDER_COMPACT_AT, ADMIN_IDS, SLOW_HANDLER_MS, LOOP_LAG_WARN_MS
+import storage, diagnostics, startup
+# тяжёлые клиенты (requests и т.п.) импортируются при первом обращении
+from startup import bitrix_client, calculator, zcb_client
 
 dp = Dispatcher()
+TRACER = diagnostics.SlowHandlerTracer(threshold_ms=SLOW_HANDLER_MS)
+LAG = diagnostics.LoopLagMonitor(warn_ms=LOOP_LAG_WARN_MS)
+LAG.tracer = TRACER
+for _observer in (dp.message, dp.callback_query, dp.inline_query):
+    _observer.middleware(TRACER)
 STATE = {}
 
 def _set(uid: int, **kwargs):
@@ -28,11 +40,11 @@ def _fmt_money(x: float) -> str: return f"{x:,.2f}".replace(",", " ")
 @dp.message(Command("start"))
 async def cmd_start(m: Message):
     _clear(m.from_user.id)
-    await m.answer("Здравствуйте! Доступно: /auth /mydeals /status /reminder /calc /org /orgraw /help.")
+    await m.answer("Здравствуйте! Доступно: /auth /mydeals /status /reminder /history /calc /org /orgraw /help.")
 
 @dp.message(Command("help"))
 async def cmd_help(m: Message):
-    await m.answer("/auth /mydeals /status /reminder /calc /org /orgraw")
+    await m.answer("/auth /mydeals /status /reminder /history /calc /org /orgraw")
 
 # ----------------- AUTH -----------------
 @dp.message(Command("auth"))
@@ -79,7 +91,7 @@ async def on_status(m: Message):
 @dp.message(Command("reminder"))
 async def cmd_reminder(m: Message):
     _set(m.from_user.id, mode="await_reminder_id")
-    await m.answer("Пример: 20520 45,10")
+    await m.answer("Пример: 20520 45,10\nИли «все 30,7» — напоминания по всем вашим сделкам.")
 
 @dp.message(F.text.regexp(r"^\d+\s+\d+(?:,\d+)*$") & F.func(lambda m: _get(m.from_user.id, "mode")=="await_reminder_id"))
 async def reminder_with_offsets(m: Message):
@@ -91,15 +103,54 @@ async def reminder_with_offsets(m: Message):
 async def reminder_id_only(m: Message):
     await _set_reminder_from_deal(m, m.text.strip(), [30,7])
 
+@dp.message(F.text.regexp(r"(?i)^(?:все|all)(?:\s+\d+(?:,\d+)*)?$") & F.func(lambda m: _get(m.from_user.id, "mode")=="await_reminder_id"))
+async def reminder_all_deals(m: Message):
+    parts = m.text.strip().split(None, 1)
+    offsets = [int(x) for x in parts[1].split(",") if x.isdigit()] if len(parts) > 1 else [30,7]
+    user = storage.get_user(m.from_user.id) or {}; inn = user.get("inn")
+    if not inn:
+        await m.answer("Сначала /auth и ИНН."); _clear(m.from_user.id); return
+    today = datetime.now().date().isoformat()
+    items = []
+    try:
+        deals = bitrix_client.all_deals_by_inn(inn)
+    except Exception as e:
+        await m.answer(f"Ошибка запроса к Bitrix: {e}"); _clear(m.from_user.id); return
+    for d in deals:
+        due = bitrix_client.due_date_of(d)
+        if not due or due < today:
+            continue
+        did = str(d.get("ID"))
+        items.append({"deal_id": did, "due_date": due,
+                      "guarantee_number": str(d.get(bitrix_client.UF_NUM_FIELD) or did)})
+    if not items:
+        await m.answer("Не нашёл сделок с будущим сроком БГ."); _clear(m.from_user.id); return
+    added = storage.add_reminders_bulk(m.from_user.id, items, offsets)
+    await m.answer(f"Подписал на {len(items)} сделок (новых напоминаний: {added}) — за {', '.join(map(str,offsets))} дн.")
+    _clear(m.from_user.id)
+
 async def _set_reminder_from_deal(m: Message, deal_id: str, offsets: list[int]):
-    due = bitrix_client.get_due_date_from_deal(deal_id)
+    d = bitrix_client.deal_get(deal_id)
+    due = bitrix_client.due_date_of(d)
     if not due:
         await m.answer("В сделке нет срока БГ."); _clear(m.from_user.id); return
-    d = bitrix_client.deal_get(deal_id); number = (d or {}).get(bitrix_client.UF_NUM_FIELD,"") or deal_id
-    storage.add_reminder(m.from_user.id, str(number), due, offsets)
+    number = (d or {}).get(bitrix_client.UF_NUM_FIELD,"") or deal_id
+    if not storage.add_reminder(m.from_user.id, str(number), due, offsets, deal_id=deal_id):
+        await m.answer(f"По #{deal_id} все даты напоминаний уже прошли (срок {due})."); _clear(m.from_user.id); return
     await m.answer(f"Напомню по #{deal_id} (№ {number}) — за {', '.join(map(str,offsets))} дн.")
     _clear(m.from_user.id)
 
+HISTORY_DAYS = 90  # /history читает архивы только за этот период
+
+@dp.message(Command("history"))
+async def cmd_history(m: Message):
+    since = (datetime.now().date() - timedelta(days=HISTORY_DAYS)).isoformat()
+    rows = storage.delivery_history(user_id=m.from_user.id, since=since)[-10:]
+    if not rows:
+        await m.answer(f"За последние {HISTORY_DAYS} дней напоминаний не было."); return
+    lines = [f"{r['remind_on']} — №{r['guarantee_number']}, срок {r['due_date']} (за {r['offset_days']} дн.)" for r in reversed(rows)]
+    await m.answer("Последние напоминания:\n" + "\n".join(lines))
+
 # ----------------- CALC -----------------
 @dp.message(Command("calc"))
 async def calc_start(m: Message):
@@ -141,11 +192,8 @@ async def calc_bank_choice(cb: CallbackQuery):
     if action=="best":
         await _compute_and_show(cb.message, None)
     else:
-        import json
         try:
-            with open("rates.json","r",encoding="utf-8") as f:
-                data = json.load(f)
-            banks = list((data.get("banks") or {}).keys())
+            banks = calculator.bank_names("rates.json")
         except Exception:
             banks = []
         rows = []
@@ -168,24 +216,75 @@ async def _compute_and_show(message: Message, prefer_bank: str | None):
     gtype = _get(uid,"gtype"); amount = _get(uid,"amount"); days = _get(uid,"days")
     if not all([gtype,amount,days]):
         await message.answer("Данных не хватает, /calc заново."); _clear(uid); return
-    offers, meta = calculator.calculate(amount=amount, days=days, gtype=gtype, prefer_bank=prefer_bank, config_path="rates.json")
+    offers, meta = calculator.calculate_cached(amount=amount, days=days, gtype=gtype, prefer_bank=prefer_bank, config_path="rates.json")
     if not offers:
         await message.answer("Нет предложений. Проверьте rates.json."); _clear(uid); return
-    def fmt(x: float): return f"{x:,.2f}".replace(","," ")
-    lines = [f"Тип: {gtype}, Сумма: {fmt(amount)} ₽, Срок: {days} дн. (корзина {meta['bucket']})"]
-    for i,o in enumerate(offers,1):
-        lines.append(f"{i}) {o.bank} — {o.rate*100:.2f}% → {fmt(o.fee)} ₽ (расчёт: {fmt(o.base_fee)} ₽, минимум: {fmt(o.min_fee)} ₽)")
     kb = InlineKeyboardMarkup(inline_keyboard=[[
         InlineKeyboardButton(text="Новый расчёт", callback_data="calc:new"),
         InlineKeyboardButton(text="Изменить банк", callback_data="bank:choose"),
     ]])
-    await message.answer("Расчёт по ставкам (rates.json):\n" + "\n".join(lines), reply_markup=kb)
+    await message.answer(_format_quote(gtype, amount, days, offers, meta), reply_markup=kb)
     _clear(uid)
 
+def _format_quote(gtype: str, amount: float, days: int, offers: list, meta: dict) -> str:
+    lines = [f"Тип: {gtype}, Сумма: {_fmt_money(amount)} ₽, Срок: {days} дн. (корзина {meta['bucket']})"]
+    for i,o in enumerate(offers,1):
+        lines.append(f"{i}) {o.bank} — {o.rate*100:.2f}% → {_fmt_money(o.fee)} ₽ (расчёт: {_fmt_money(o.base_fee)} ₽, минимум: {_fmt_money(o.min_fee)} ₽)")
+    return "Расчёт по ставкам (rates.json):\n" + "\n".join(lines)
+
 @dp.callback_query(F.data=="calc:new")
 async def calc_new(cb: CallbackQuery):
     _clear(cb.from_user.id); await calc_start(cb.message); await cb.answer()
 
+# ----------------- INLINE CALC (@bot сумма срок тип) -----------------
+def _parse_inline_quote(query: str) -> tuple[str, float, int] | None:
+    """'10000000 90 тендер' (в любом порядке; тип можно сократить: 'тенд') -> (тип, сумма, дни)."""
+    gtype = None; numbers = []
+    types = calculator.guarantee_types("rates.json")
+    for tok in query.lower().split():
+        num = re.fullmatch(r"(\d+)(?:д|дн|дн\.|дней)?", tok)
+        if num:
+            numbers.append(num.group(1)); continue
+        match = [t for t in types if t.startswith(tok)]
+        if gtype is None and len(match) == 1:
+            gtype = match[0]
+    if not gtype or len(numbers) != 2:
+        return None
+    # сумма всегда больше срока, поэтому порядок чисел не важен
+    days, amount = sorted(numbers, key=int)
+    if len(amount) < 5 or len(amount) > 15 or not 0 < int(days) < 10000:
+        return None
+    return gtype, float(amount), int(days)
+
+@dp.inline_query()
+async def inline_calc(q: InlineQuery):
+    try:
+        parsed = _parse_inline_quote(q.query)
+    except Exception:
+        parsed = None
+    if not parsed:
+        await q.answer([], cache_time=5); return
+    gtype, amount, days = parsed
+    offers, meta = calculator.calculate_cached(amount=amount, days=days, gtype=gtype, config_path="rates.json")
+    if not offers:
+        await q.answer([], cache_time=5); return
+    text = _format_quote(gtype, amount, days, offers, meta)
+    results = [InlineQueryResultArticle(
+        id="best",
+        title=f"{gtype}: {_fmt_money(amount)} ₽ на {days} дн.",
+        description=" / ".join(f"{o.bank} {_fmt_money(o.fee)} ₽" for o in offers),
+        input_message_content=InputTextMessageContent(message_text=text),
+    )]
+    for i, o in enumerate(offers, 1):
+        results.append(InlineQueryResultArticle(
+            id=f"offer{i}",
+            title=f"{o.bank} — {_fmt_money(o.fee)} ₽",
+            description=f"{o.rate*100:.2f}% годовых, минимум {_fmt_money(o.min_fee)} ₽",
+            input_message_content=InputTextMessageContent(message_text=_format_quote(gtype, amount, days, [o], meta)),
+        ))
+    # короткий cache_time: свежесть ставок обеспечивает наш кэш, Telegram пусть держит недолго
+    await q.answer(results, cache_time=30)
+
 # ----------------- ORG (Monitoring add-id -> card) -----------------
 @dp.message(Command("org"))
 async def org_start(m: Message):
@@ -200,12 +299,12 @@ async def org_by_inn(m: Message):
     except Exception as e:
         await m.answer(f"Ошибка запроса: {e}"); _clear(m.from_user.id); return
     parts = [f"Компания по ИНН {inn}"]
-    if info.get("name"): parts.append(f"Наименование: {info['name']}")
-    if info.get("ogrn"): parts.append(f"ОГРН: {info['ogrn']}")
-    if info.get("kpp"): parts.append(f"КПП: {info['kpp']}")
-    if info.get("status"): parts.append(f"Статус: {info['status']}")
-    if info.get("address"): parts.append(f"Адрес: {info['address']}")
-    if info.get("okved"): parts.append(f"ОКВЭД: {info['okved']}")
+    if info.name: parts.append(f"Наименование: {info.name}")
+    if info.ogrn: parts.append(f"ОГРН: {info.ogrn}")
+    if info.kpp: parts.append(f"КПП: {info.kpp}")
+    if info.status: parts.append(f"Статус: {info.status}")
+    if info.address: parts.append(f"Адрес: {info.address}")
+    if info.okved: parts.append(f"ОКВЭД: {info.okved}")
     await m.answer("\n".join(parts)); _clear(m.from_user.id)
 
 # ----------------- ORGRAW (диагностика) -----------------
@@ -221,42 +320,155 @@ async def orgraw_by_inn(m: Message):
         info = zcb_client.ensure_added_then_card(inn)
     except Exception as e:
         await m.answer(f"Ошибка запроса: {e}"); _clear(m.from_user.id); return
-    raw = info.get("raw") or {}
-    snippet = json.dumps(raw, ensure_ascii=False)[:800]
+    snippet = info.raw_snippet(800)
     await m.answer(
         f"Ключевые поля:\n"
-        f"name: {info.get('name')}\ninn: {info.get('inn')}\nogrn: {info.get('ogrn')}\n"
-        f"kpp: {info.get('kpp')}\nstatus: {info.get('status')}\naddress: {info.get('address')}\nokved: {info.get('okved')}\n\n"
+        f"name: {info.name}\ninn: {info.inn}\nogrn: {info.ogrn}\n"
+        f"kpp: {info.kpp}\nstatus: {info.status}\naddress: {info.address}\nokved: {info.okved}\n\n"
         f"RAW (фрагмент):\n{snippet}"
     )
     _clear(m.from_user.id)
 
+# ----------------- Диагностика (только ADMIN_IDS) -----------------
+@dp.message(Command("diag"), F.from_user.id.in_(ADMIN_IDS))
+async def cmd_diag(m: Message):
+    st = LAG.stats()
+    await m.answer(
+        f"Задержка event loop: сейчас {st['last_ms']:.0f} мс, p95 {st['p95_ms']:.0f} мс, макс {st['max_ms']:.0f} мс "
+        f"({st['samples']} замеров)\n{startup.format_report()}\n\nМедленные хендлеры (> {SLOW_HANDLER_MS:.0f} мс):\n{TRACER.format_slow()}"
+    )
+
+@dp.message(Command("profile"), F.from_user.id.in_(ADMIN_IDS))
+async def cmd_profile(m: Message):
+    parts = (m.text or "").split()
+    if len(parts) > 1 and parts[1].lower() == "stop":
+        if not await TRACER.stop_profile(m.bot):
+            await m.answer("Профилирование не идёт.")
+        return
+    n = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 20
+    n = max(1, min(n, 1000))
+    if TRACER.start_profile(n, m.chat.id, m.bot):
+        await m.answer(f"Профилирую следующие {n} апдейтов (не дольше {diagnostics.PROFILE_MAX_S // 60} мин), отчёт пришлю файлом. "
+                       f"Досрочно: /profile stop")
+    else:
+        await m.answer("Профилирование уже идёт.")
+
 # ----------------- Цифры вне режимов -----------------
 @dp.message(F.text.regexp(r"^\d+$") & ~F.func(lambda m: _get(m.from_user.id,"mode") in {"await_inn","await_status","await_reminder_id","calc_amount","calc_days","calc_bank","calc_type","await_org_inn","await_orgraw_inn"}))
 async def general_digits(m: Message):
     status = bitrix_client.get_status_by_number(m.text.strip())
     await m.answer(status or "Команда не распознана. Используйте /status или /calc.")
 
-# ----------------- Доставка напоминаний -----------------
+# ----------------- Доставка напоминаний (дайджест) -----------------
+DIGEST_CHUNK = 3800  # запас до лимита Telegram в 4096 символов
+
+def _parse_window(spec: str) -> tuple[dtime, dtime] | None:
+    """'09:00-18:00' -> (09:00, 18:00); пусто или мусор — без ограничений."""
+    try:
+        start, end = (dtime.fromisoformat(x.strip()) for x in spec.split("-", 1))
+        return start, end
+    except Exception:
+        return None
+
+def _in_delivery_window(now: datetime, window: tuple[dtime, dtime] | None) -> bool:
+    if not window: return True
+    start, end = window; t = now.time()
+    return start <= t < end if start <= end else (t >= start or t < end)
+
+def _group_digests(rems: list[dict]) -> dict[tuple, list[dict]]:
+    groups: dict[tuple, list[dict]] = {}
+    for r in rems:
+        groups.setdefault((r["user_id"], r["remind_on"]), []).append(r)
+    for items in groups.values():
+        items.sort(key=lambda r: (r["due_date"], r["guarantee_number"]))
+    return groups
+
+def _format_digest(items: list[dict]) -> list[tuple[str, list[dict]]]:
+    """Один текст на группу; если не влезает в сообщение — режем по строкам.
+    Каждая часть идёт вместе со своими напоминаниями, чтобы помечать их отправленными по частям."""
+    head = f"Напоминания по гарантиям ({len(items)}):"
+    chunks, cur, cur_items = [], head, []
+    for r in items:
+        line = f"• №{r['guarantee_number']} — срок {r['due_date']}, осталось {r['offset_days']} дн."
+        if cur_items and len(cur) + len(line) + 1 > DIGEST_CHUNK:
+            chunks.append((cur, cur_items)); cur, cur_items = line, []
+        else:
+            cur += "\n" + line
+        cur_items.append(r)
+    chunks.append((cur, cur_items))
+    return chunks
+
 async def reminder_daemon(bot: Bot):
+    window = _parse_window(REMINDER_WINDOW)
     while True:
-        for rem in storage.due_reminders_today():
-            try:
-                await bot.send_message(
-                    chat_id=rem["user_id"],
-                    text=f"Напоминание по гарантии №{rem['guarantee_number']}. Срок: {rem['due_date']}. Осталось {rem['offset_days']} дн."
-                )
-                storage.mark_reminder_sent(rem)
-            except Exception:
-                pass
+        if _in_delivery_window(datetime.now(), window):
+            for (user_id, _day), items in _group_digests(storage.due_reminders_today()).items():
+                try:
+                    for text, part in _format_digest(items):
+                        await bot.send_message(chat_id=user_id, text=text)
+                        # доставленную часть гасим сразу: при сбое на следующей не повторим её
+                        storage.mark_reminders_sent(part)
+                except Exception:
+                    pass
         await asyncio.sleep(60)
 
+# ----------------- Ночная сверка сроков с Bitrix -----------------
+async def resync_reminders() -> int:
+    """Одним проходом batch-запросов обновляет сроки всех сделок с неотправленными напоминаниями."""
+    deal_ids = storage.pending_reminder_deals()
+    if not deal_ids:
+        return 0
+    due_by_deal = await asyncio.to_thread(bitrix_client.due_dates_batch, deal_ids)
+    return storage.resync_due_dates({k: v for k, v in due_by_deal.items() if v})
+
+def _seconds_until(at: dtime, now: datetime) -> float:
+    target = datetime.combine(now.date(), at)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+async def reminder_resync_daemon():
+    try:
+        at = dtime.fromisoformat(REMINDER_RESYNC_AT)
+    except ValueError:
+        at = dtime(3, 0)
+    while True:
+        await asyncio.sleep(_seconds_until(at, datetime.now()))
+        try:
+            await resync_reminders()
+        except Exception:
+            pass
+
+# ----------------- Ретеншн: архивирование отправленных/просроченных -----------------
+async def reminder_compact_daemon():
+    try:
+        at = dtime.fromisoformat(REMINDER_COMPACT_AT)
+    except ValueError:
+        at = dtime(4, 0)
+    while True:
+        try:
+            moved = storage.compact_reminders()
+            if moved:
+                logging.info("reminders archived: %s", moved)
+        except Exception:
+            logging.exception("reminder compaction failed")
+        await asyncio.sleep(_seconds_until(at, datetime.now()))
+
 # ----------------- Точка входа -----------------
 async def main():
-    if not BOT_TOKEN:
-        raise RuntimeError("BOT_TOKEN is empty. Set it in .env")
+    logging.basicConfig(level=logging.INFO)
+    errors, warnings = config.validate()
+    for w in warnings:
+        logging.warning("config: %s", w)
+    if errors:
+        raise RuntimeError("; ".join(errors))
     bot = Bot(BOT_TOKEN, parse_mode=None)
+    dp.startup.register(startup.on_polling_started)
+    asyncio.create_task(startup.warm_up())
     asyncio.create_task(reminder_daemon(bot))
+    asyncio.create_task(reminder_resync_daemon())
+    asyncio.create_task(reminder_compact_daemon())
+    asyncio.create_task(LAG.run())
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
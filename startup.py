@@ -0,0 +1,123 @@
+# --- Что фиксим этим файлом (startup.py) ---
+# Проблема: main.py при импорте тянул bitrix_client, calculator и zcb_client (а с ними requests),
+# ошибки в .env всплывали только на первом запросе пользователя, а кэши (стадии, ставки,
+# карточки компаний) стартовали холодными — первые пользователи после рестарта ждали дольше всех.
+# Что должно заработать:
+#   - lazy("модуль") — модуль импортируется при первом обращении к атрибуту;
+#   - warm_up() — ограниченный по времени прогрев кэшей параллельно со стартом polling;
+#   - REPORT — время до готовности (polling запущен и прогрев завершён) для лога и /diag.
+import asyncio
+import importlib
+import logging
+import time
+from types import ModuleType
+from typing import Any, Dict, Optional
+
+import storage
+from config import WARMUP_TIMEOUT, WARMUP_CATEGORIES, WARMUP_INNS, WARMUP_MAX_INNS, ZCB_API_KEY
+from config import BITRIX_DOMAIN, BITRIX_REST_PATH
+
+log = logging.getLogger("bfgbot.startup")
+
+T0 = time.perf_counter()
+REPORT: Dict[str, Any] = {"polling_s": None, "warmup_s": None, "ready_s": None, "steps": {}}
+
+class LazyModule:
+    def __init__(self, name: str):
+        self._name = name
+        self._module: Optional[ModuleType] = None
+
+    def __getattr__(self, attr: str) -> Any:
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+def lazy(name: str) -> Any:
+    return LazyModule(name)
+
+bitrix_client = lazy("bitrix_client")
+calculator = lazy("calculator")
+zcb_client = lazy("zcb_client")
+
+def _since_start() -> float:
+    return time.perf_counter() - T0
+
+def _maybe_ready() -> None:
+    if REPORT["polling_s"] is None or REPORT["warmup_s"] is None or REPORT["ready_s"] is not None:
+        return
+    REPORT["ready_s"] = max(REPORT["polling_s"], REPORT["warmup_s"])
+    log.info("ready in %.2f s (polling %.2f s, warm-up %.2f s: %s)", REPORT["ready_s"],
+             REPORT["polling_s"], REPORT["warmup_s"], format_steps())
+
+async def on_polling_started() -> None:
+    """dp.startup: polling поднят, бот уже принимает апдейты."""
+    REPORT["polling_s"] = _since_start()
+    _maybe_ready()
+
+def format_steps() -> str:
+    return ", ".join(f"{k} {v}" for k, v in REPORT["steps"].items()) or "-"
+
+def format_report() -> str:
+    if REPORT["ready_s"] is None:
+        return f"Старт: ещё прогревается ({_since_start():.1f} с), {format_steps()}"
+    return f"Старт: готов за {REPORT['ready_s']:.2f} с (прогрев {REPORT['warmup_s']:.2f} с: {format_steps()})"
+
+async def _step(name: str, fn, *args) -> None:
+    t = time.perf_counter()
+    try:
+        result = await asyncio.to_thread(fn, *args)
+        REPORT["steps"][name] = f"{result} за {time.perf_counter() - t:.2f} с"
+    except Exception as e:
+        REPORT["steps"][name] = f"ошибка: {e}"
+
+def _warm_rates() -> str:
+    return f"банков: {len(calculator.bank_names('rates.json'))}"
+
+def _warm_stages(deadline: float) -> str:
+    return f"стадий: {bitrix_client.warm_stage_names(WARMUP_CATEGORIES, deadline)}"
+
+def _hot_inns() -> list:
+    inns = list(dict.fromkeys(WARMUP_INNS + storage.user_inns()))
+    return [x for x in inns if x.isdigit() and len(x) in (10, 12)][:WARMUP_MAX_INNS]
+
+async def _warm_cards(deadline: float) -> str:
+    inns = await asyncio.to_thread(_hot_inns)
+    sem = asyncio.Semaphore(4)
+    ok = 0
+
+    async def one(inn: str) -> None:
+        nonlocal ok
+        async with sem:
+            # после дедлайна новые ИНН не начинаем; начатые запросы ограничены остатком бюджета
+            if time.monotonic() >= deadline:
+                return
+            try:
+                await asyncio.to_thread(zcb_client.ensure_added_then_card, inn, deadline)
+                ok += 1
+            except Exception:
+                pass
+
+    await asyncio.gather(*(one(inn) for inn in inns))
+    return f"карточек: {ok}/{len(inns)}"
+
+async def warm_up() -> None:
+    """Прогрев кэшей, не дольше WARMUP_TIMEOUT секунд; не мешает обработке апдейтов.
+    Дедлайн передаётся в клиенты: таймауты запросов берутся из остатка бюджета, чтобы потоки
+    to_thread не продолжали ходить в Bitrix/ЗЧБ после таймаута."""
+    deadline = time.monotonic() + WARMUP_TIMEOUT
+    steps = [_step("ставки", _warm_rates)]
+    if BITRIX_DOMAIN and BITRIX_REST_PATH:
+        steps.append(_step("стадии", _warm_stages, deadline))
+    if ZCB_API_KEY and WARMUP_MAX_INNS > 0:
+        t = time.perf_counter()
+
+        async def cards() -> None:
+            REPORT["steps"]["ИНН"] = await _warm_cards(deadline) + f" за {time.perf_counter() - t:.2f} с"
+
+        steps.append(cards())
+    try:
+        await asyncio.wait_for(asyncio.gather(*steps), timeout=WARMUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        REPORT["steps"]["таймаут"] = f"{WARMUP_TIMEOUT:.0f} с"
+    REPORT["warmup_s"] = _since_start()
+    _maybe_ready()
@@ -2,12 +2,17 @@
 # Проблема: не было нормальной авторизации по ИНН и привязки напоминаний к пользователю.
 # Что должно заработать: хранение ИНН в профиле пользователя, быстрые геттеры/сеттеры,
 # удобное добавление напоминаний. Совместимо с прежним data.json.
+# Ретеншн: отправленные и просроченные напоминания переносятся compact_reminders() в сжатый архив
+# archive/reminders-ГГГГ-ММ.json.gz (по месяцу remind_on); в data.json остаются только будущие.
+# История доставки — delivery_history().
+import gzip
 import json
 from pathlib import Path
 from typing import Dict, Any, Optional, List
 from datetime import datetime, timedelta
 
 DATA_FILE = Path("data.json")
+ARCHIVE_DIR = Path("archive")
 
 def _load() -> Dict[str, Any]:
     if not DATA_FILE.exists():
@@ -39,34 +44,245 @@ def get_user(user_id: int) -> Optional[Dict[str, Any]]:
     data = _load()
     return data["users"].get(str(user_id))
 
-def add_reminder(user_id: int, guarantee_number: str, due_date: str, offsets_days: List[int]) -> None:
-    """due_date format YYYY-MM-DD"""
+def user_inns() -> List[str]:
+    """ИНН всех авторизованных пользователей (без повторов)."""
     data = _load()
+    return list(dict.fromkeys(u["inn"] for u in data["users"].values() if u.get("inn")))
+
+def _reminder_rows(user_id: int, guarantee_number: str, due_date: str, offsets_days: List[int],
+                   deal_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    rows = []
     for offset in offsets_days:
-        from datetime import datetime, timedelta
         remind_on = (datetime.fromisoformat(due_date) - timedelta(days=offset)).date().isoformat()
-        data["reminders"].append({
+        row = {
             "user_id": user_id,
             "guarantee_number": guarantee_number,
             "due_date": due_date,
             "offset_days": offset,
             "remind_on": remind_on,
-            "sent": False
-        })
+            "sent": False,
+            # весь набор офсетов подписки: по нему resync_due_dates восстанавливает уже ушедшие в архив
+            "offsets": list(offsets_days)
+        }
+        if deal_id:
+            row["deal_id"] = str(deal_id)
+        rows.append(row)
+    return rows
+
+def add_reminder(user_id: int, guarantee_number: str, due_date: str, offsets_days: List[int],
+                 deal_id: Optional[str] = None) -> int:
+    """due_date format YYYY-MM-DD. Офсеты с уже прошедшей датой напоминания не сохраняются.
+    Возвращает число сохранённых напоминаний."""
+    today = datetime.now().date().isoformat()
+    rows = [r for r in _reminder_rows(user_id, guarantee_number, due_date, offsets_days, deal_id)
+            if r["remind_on"] >= today]
+    if not rows:
+        return 0
+    data = _load()
+    data["reminders"].extend(rows)
     _save(data)
+    return len(rows)
+
+def add_reminders_bulk(user_id: int, items: List[Dict[str, str]], offsets_days: List[int]) -> int:
+    """items: [{"deal_id", "guarantee_number", "due_date"}]. Одна запись data.json на всю пачку.
+    На сделку/офсет держим одно неотправленное напоминание: если срок в Bitrix сменился,
+    существующая строка переносится на новый срок, а не дублируется. Отправленные по тому же
+    сроку заново не заводятся."""
+    data = _load()
+    today = datetime.now().date().isoformat()
+    pending = {(r["user_id"], r.get("deal_id"), r["offset_days"]): r for r in data["reminders"]
+               if not r["sent"] and r.get("deal_id")}
+    sent = {(r["user_id"], r.get("deal_id"), r["due_date"], r["offset_days"]) for r in data["reminders"] if r["sent"]}
+    added = 0
+    for it in items:
+        for row in _reminder_rows(user_id, it["guarantee_number"], it["due_date"], offsets_days, it.get("deal_id")):
+            old = pending.get((row["user_id"], row.get("deal_id"), row["offset_days"]))
+            if old is not None:
+                if old["due_date"] != row["due_date"]:
+                    _move_row(old, row["due_date"], today)
+                    added += 1
+                continue
+            # прошедшие даты не добавляем: они бы сразу ушли в архив как просроченные
+            if (row["user_id"], row.get("deal_id"), row["due_date"], row["offset_days"]) in sent \
+                    or row["remind_on"] < today:
+                continue
+            pending[(row["user_id"], row.get("deal_id"), row["offset_days"])] = row
+            data["reminders"].append(row)
+            added += 1
+    if added:
+        _save(data)
+    return added
+
+def pending_reminder_deals(today: Optional[str] = None) -> List[str]:
+    """Сделки, по которым ещё есть что сверять: неотправленные напоминания или действующий срок БГ."""
+    if today is None:
+        today = datetime.now().date().isoformat()
+    data = _load()
+    return list(dict.fromkeys(r["deal_id"] for r in data["reminders"]
+                              if r.get("deal_id") and (not r["sent"] or r["due_date"] >= today)))
+
+def _remind_on(due_date: str, offset: int) -> str:
+    return (datetime.fromisoformat(due_date) - timedelta(days=offset)).date().isoformat()
+
+def _move_row(r: Dict[str, Any], new_due: str, today: str) -> None:
+    """Неотправленное напоминание — на новый срок; прошедший remind_on при действующем сроке — на сегодня."""
+    r["due_date"] = new_due
+    r["remind_on"] = _remind_on(new_due, r["offset_days"])
+    if r["remind_on"] < today <= new_due:
+        r["remind_on"] = today
+
+def resync_due_dates(due_by_deal: Dict[str, str], today: Optional[str] = None) -> int:
+    """Переносит напоминания на новый срок сделки. Возвращает число изменённых/добавленных строк.
+    - неотправленные: новый remind_on; если он уже прошёл, а срок ещё впереди — ставим на сегодня;
+    - отправленные офсеты с новым remind_on >= today — заводим заново отдельной строкой
+      (старая остаётся в истории как отправленная);
+    - строка, которая после переноса совпала бы с уже имеющейся (тот же офсет на новом сроке
+      или второе напоминание на сегодня), удаляется — дайджест не получит дубль."""
+    if today is None:
+        today = datetime.now().date().isoformat()
+    data = _load()
+    subs: Dict[tuple, Dict[str, Any]] = {}
+    for r in data["reminders"]:
+        new_due = due_by_deal.get(r.get("deal_id") or "")
+        if not new_due:
+            continue
+        sub = subs.setdefault((r["user_id"], r["deal_id"]), {"due": new_due, "rows": [], "offsets": set()})
+        sub["rows"].append(r)
+        sub["offsets"].add(r["offset_days"])
+        sub["offsets"].update(r.get("offsets") or [])
+    changed = 0
+    for (user_id, deal_id), sub in subs.items():
+        new_due = sub["due"]
+        if all(r["due_date"] == new_due for r in sub["rows"]):
+            continue
+        covered = {r["offset_days"] for r in sub["rows"] if r["due_date"] == new_due}
+        today_live = any(not r["sent"] and r["remind_on"] == today for r in sub["rows"] if r["due_date"] == new_due)
+        dropped = []
+        for r in sub["rows"]:
+            if r["sent"] or r["due_date"] == new_due:
+                continue
+            changed += 1
+            if r["offset_days"] in covered:
+                dropped.append(r)
+                continue
+            _move_row(r, new_due, today)
+            if r["remind_on"] == today:
+                if today_live:
+                    dropped.append(r)
+                    continue
+                today_live = True
+            covered.add(r["offset_days"])
+        if dropped:
+            ids = {id(r) for r in dropped}
+            data["reminders"] = [r for r in data["reminders"] if id(r) not in ids]
+            sub["rows"] = [r for r in sub["rows"] if id(r) not in ids]
+        template = sub["rows"][-1]
+        for offset in sorted(sub["offsets"] - covered, reverse=True):
+            if _remind_on(new_due, offset) < today:
+                continue
+            row = _reminder_rows(user_id, template["guarantee_number"], new_due, [offset], deal_id)[0]
+            row["offsets"] = sorted(sub["offsets"], reverse=True)
+            data["reminders"].append(row)
+            changed += 1
+    if changed:
+        _save(data)
+    return changed
 
 def due_reminders_today(today: Optional[str] = None) -> list:
     data = _load()
     if today is None:
-        from datetime import datetime
         today = datetime.now().date().isoformat()
     return [r for r in data["reminders"] if r["remind_on"] == today and not r["sent"]]
 
+def _reminder_key(r) -> tuple:
+    return (r["user_id"], r["guarantee_number"], r["remind_on"], r["offset_days"])
+
 def mark_reminder_sent(rem) -> None:
+    mark_reminders_sent([rem])
+
+def mark_reminders_sent(rems: List[Dict[str, Any]]) -> None:
+    """Помечает отправленной всю группу за одно чтение/запись data.json."""
+    keys = {_reminder_key(r) for r in rems}
+    if not keys:
+        return
     data = _load()
+    sent_at = datetime.now().isoformat(timespec="seconds")
     for r in data["reminders"]:
-        if (r["user_id"] == rem["user_id"] and r["guarantee_number"] == rem["guarantee_number"]
-            and r["remind_on"] == rem["remind_on"] and r["offset_days"] == rem["offset_days"]):
+        # дубликаты одной и той же строки тоже гасим, иначе они уйдут повторно
+        if not r["sent"] and _reminder_key(r) in keys:
             r["sent"] = True
-            break
+            r["sent_at"] = sent_at
     _save(data)
+
+# ----------------- Архив (ретеншн) -----------------
+def _archive_path(month: str) -> Path:
+    return ARCHIVE_DIR / f"reminders-{month}.json.gz"
+
+def _archive_load(month: str) -> List[Dict[str, Any]]:
+    path = _archive_path(month)
+    if not path.exists():
+        return []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+def _archive_save(month: str, rows: List[Dict[str, Any]]) -> None:
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    path = _archive_path(month)
+    tmp = path.with_suffix(".tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False, separators=(",", ":"))
+    tmp.replace(path)
+
+def archive_months() -> List[str]:
+    """Месяцы (ГГГГ-ММ), за которые есть архив, по возрастанию."""
+    if not ARCHIVE_DIR.exists():
+        return []
+    return sorted(p.name[len("reminders-"):-len(".json.gz")] for p in ARCHIVE_DIR.glob("reminders-*.json.gz"))
+
+def compact_reminders(today: Optional[str] = None) -> Dict[str, int]:
+    """Переносит в архив по месяцам напоминания с remind_on < today: отправленные и просроченные.
+    Сегодняшние (даже отправленные) остаются до завтра — по ним add_reminders_bulk отсекает дубликаты.
+    Возвращает {месяц: сколько перенесено}."""
+    if today is None:
+        today = datetime.now().date().isoformat()
+    data = _load()
+    live, moved = [], {}
+    archived_at = datetime.now().isoformat(timespec="seconds")
+    for r in data["reminders"]:
+        if r["remind_on"] >= today:
+            live.append(r)
+            continue
+        moved.setdefault(r["remind_on"][:7], []).append(
+            {**r, "status": "sent" if r["sent"] else "expired", "archived_at": archived_at})
+    if not moved:
+        return {}
+    for month, rows in moved.items():
+        old = _archive_load(month)
+        # повторный запуск после сбоя между записью архива и data.json не плодит дубликаты
+        seen = {(_reminder_key(r), r["status"]) for r in old}
+        old.extend(r for r in rows if (_reminder_key(r), r["status"]) not in seen)
+        _archive_save(month, old)
+    data["reminders"] = live
+    _save(data)
+    return {month: len(rows) for month, rows in moved.items()}
+
+def delivery_history(user_id: Optional[int] = None, since: Optional[str] = None, until: Optional[str] = None,
+                     guarantee_number: Optional[str] = None, status: Optional[str] = "sent") -> List[Dict[str, Any]]:
+    """История напоминаний из архива (и ещё не заархивированных отправленных) с фильтрами.
+    since/until — даты YYYY-MM-DD по remind_on включительно; status — "sent", "expired" или None (все).
+    Читаются только архивы нужных месяцев."""
+    def match(r: Dict[str, Any]) -> bool:
+        return ((user_id is None or r["user_id"] == user_id)
+                and (since is None or r["remind_on"] >= since)
+                and (until is None or r["remind_on"] <= until)
+                and (guarantee_number is None or r["guarantee_number"] == guarantee_number)
+                and (status is None or r.get("status") == status))
+    rows: List[Dict[str, Any]] = []
+    for month in archive_months():
+        if (since and month < since[:7]) or (until and month > until[:7]):
+            continue
+        rows.extend(r for r in _archive_load(month) if match(r))
+    if status in (None, "sent"):
+        rows.extend(r2 for r2 in ({**r, "status": "sent"} for r in _load()["reminders"] if r["sent"]) if match(r2))
+    rows.sort(key=lambda r: (r["remind_on"], r.get("sent_at", "")))
+    return rows
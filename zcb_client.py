@@ -3,27 +3,38 @@
 # Что должно заработать: более «умный» парсер с РЕКУРСИВНЫМ поиском ключей по синонимам (рус/англ),
 # чтобы вытаскивать name/inn/ogrn/kpp/status/address/okved из любой разумной структуры.
 #
+# Результат — компактная CompanyRecord; сырой body уходит в сжатое хранилище (company_record.put_raw).
+#
 # API: monitoring/add-id -> monitoring/card (id = ИНН/ОГРН/ОГРНИП/ИННФЛ)
 # Требуется: requests
 
-import os
 import re
+import time
 import requests
-from typing import Dict, Any, Iterable
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+from company_record import CompanyRecord, put_raw
+from config import ZCB_API_KEY as API_KEY, ZCB_MON_ADD_ID_URL as ADD_ID_URL, ZCB_MON_CARD_URL as CARD_URL, ZCB_CARD_TTL
+from config import ZCB_CARD_CACHE_SIZE
 
-API_KEY = os.getenv("ZCB_API_KEY", "").strip()
-ADD_ID_URL = os.getenv("ZCB_MON_ADD_ID_URL",
-    "https://zachestnyibiznesapi.ru/monitoring/data/add-id?id={id}&api_key={key}"
-).strip()
-CARD_URL = os.getenv("ZCB_MON_CARD_URL",
-    "https://zachestnyibiznesapi.ru/monitoring/data/card?id={id}&api_key={key}"
-).strip()
+# ИНН -> (время, карточка); прогревается при старте для «горячих» ИНН
+_CARD_CACHE: "OrderedDict[str, Tuple[float, CompanyRecord]]" = OrderedDict()  # LRU, не больше ZCB_CARD_CACHE_SIZE
 
 class ZCBError(Exception):
     pass
 
-def _get_json(url: str) -> Dict[str, Any]:
-    r = requests.get(url, timeout=25)
+def _timeout(deadline: Optional[float], default: float = 25) -> float:
+    """Таймаут запроса с учётом общего дедлайна (time.monotonic()); после дедлайна — TimeoutError."""
+    if deadline is None:
+        return default
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TimeoutError("deadline passed")
+    return min(default, left)
+
+def _get_json(url: str, timeout: float = 25) -> Dict[str, Any]:
+    r = requests.get(url, timeout=timeout)
     r.raise_for_status()
     data = r.json()
     if isinstance(data, dict) and str(data.get("status")) not in {"200", "0", "OK", "ok"} and not data.get("body"):
@@ -69,17 +80,33 @@ STATUS_KEYS  = ["Статус", "status", "egrul.status"]
 ADDRESS_KEYS = ["АдресПолн", "Адрес", "address", "addr", "egrul.address"]
 OKVED_KEYS   = ["ОКВЭДОснКод", "okved", "ОКВЭД", "egrul.okved.main.code"]
 
-def ensure_added_then_card(inn: str) -> Dict[str, Any]:
+def ensure_added_then_card(inn: str, deadline: Optional[float] = None) -> CompanyRecord:
+    """deadline (time.monotonic()) ограничивает запросы по времени — используется прогревом."""
     if not API_KEY:
         raise ZCBError("ZCB_API_KEY не задан в .env")
     if not inn or not inn.isdigit() or len(inn) not in (10, 12):
         raise ZCBError("Некорректный ИНН")
+    hit = _CARD_CACHE.get(inn)
+    if hit and time.time() - hit[0] < ZCB_CARD_TTL:
+        _CARD_CACHE.move_to_end(inn)
+        return hit[1]
+    rec = _fetch_card(inn, deadline)
+    if ZCB_CARD_CACHE_SIZE > 0:
+        _CARD_CACHE[inn] = (time.time(), rec)
+        _CARD_CACHE.move_to_end(inn)
+        while len(_CARD_CACHE) > ZCB_CARD_CACHE_SIZE:
+            _CARD_CACHE.popitem(last=False)
+    else:
+        _CARD_CACHE.pop(inn, None)
+    return rec
+
+def _fetch_card(inn: str, deadline: Optional[float] = None) -> CompanyRecord:
 
     add_url = ADD_ID_URL.replace("{id}", inn).replace("{key}", API_KEY)
-    _get_json(add_url)  # ok if 200/ok
+    _get_json(add_url, _timeout(deadline))  # ok if 200/ok
 
     card_url = CARD_URL.replace("{id}", inn).replace("{key}", API_KEY)
-    obj = _get_json(card_url)
+    obj = _get_json(card_url, _timeout(deadline))
     body = obj.get("body") or obj
 
     name = _find_first(body, NAME_KEYS)
@@ -94,14 +121,13 @@ def ensure_added_then_card(inn: str) -> Dict[str, Any]:
     def clean(s: str) -> str:
         return re.sub(r"\s+", " ", s).strip()
 
-    normalized = {
-        "name": clean(name) if name else "(без названия)",
-        "inn": clean(innv) if innv else inn,
-        "ogrn": clean(ogrn),
-        "kpp":  clean(kpp),
-        "status": clean(status),
-        "address": clean(address),
-        "okved": clean(okved),
-        "raw": body,
-    }
-    return normalized
+    return CompanyRecord(
+        name=clean(name) if name else "(без названия)",
+        inn=clean(innv) if innv else inn,
+        ogrn=clean(ogrn),
+        kpp=clean(kpp),
+        status=clean(status),
+        address=clean(address),
+        okved=clean(okved),
+        raw_ref=put_raw(body),
+    )